@@ -48,7 +48,7 @@ Ask up to 7 questions to reflect on the intern’s future career aspirations and
 
 Summary and evaluation
 
-To conclude, write a detailed summary of the answers that the respondent gave in this interview. After your summary, add the text: 'To conclude, how well does the summary of our discussion describe your reasons for choosing your education and occupation: 1 (it poorly describes my reasons), 2 (it partially describes my reasons), 3 (it describes my reasons well), 4 (it describes my reasons very well). Please only reply with the associated number.'
+To conclude, reply with exactly the code 's4m9' and no other text. A detailed summary of the answers that the respondent gave in this interview, followed by a question asking the respondent to rate the summary, will then be shown to the respondent.
 
 After receiving the score from the concluding question end the interview. In order to end the interview, only reply with the code 'x7y8' and no other text."""
 
@@ -76,9 +76,37 @@ Lastly, there are specific codes that must be used exclusively in designated sit
 
 Problematic content: If the respondent writes legally or ethically problematic content, please reply with exactly the code '5j3k' and no other text.
 
+Summary: When you reach the 'Summary and evaluation' part of the Interview Outline, please reply with exactly the code 's4m9' and no other text.
+
 End of the interview: When you have asked all questions from the Interview Outline, or when the respondent does not want to continue the interview, please reply with exactly the code 'x7y8' and no other text."""
 
 
+# Code with which the model requests the summary of the interview
+SUMMARY_CODE = "s4m9"
+
+
+# Instructions for the summariser, which summarises batches of the interview in the
+# background while the interview is in progress; the final summary joins these pieces
+SUMMARY_PROMPT = """You are summarising a self-reflection interview with an intern in the Business Studies program at Leiden University.
+
+You receive one part of the interview transcript. Reply with a concise summary of the answers that the respondent gave in this part, addressed to the respondent (e.g. 'You explained that...'). Your summary will be joined with the summaries of the other parts of the interview, so write a single paragraph of at most 120 words without headings, introduction, or conclusion. Only reply with the summary and no other text."""
+
+
+# Question displayed after the summary (it is part of the same message)
+SUMMARY_QUESTION = "To conclude, how well does the summary of our discussion describe your reasons for choosing your education and occupation: 1 (it poorly describes my reasons), 2 (it partially describes my reasons), 3 (it describes my reasons well), 4 (it describes my reasons very well). Please only reply with the associated number."
+
+
+# Minimum number of new messages before they are summarised in the background
+SUMMARY_FOLD_MESSAGES = 6
+
+# Maximum number of tokens of each piece of the summary
+SUMMARY_MAX_OUTPUT_TOKENS = 256
+
+
+# Displayed instead of the summary if it could not be generated
+SUMMARY_UNAVAILABLE = "Unfortunately, the summary of our discussion could not be generated."
+
+
 # Pre-written closing messages for codes
 CLOSING_MESSAGES = {}
 CLOSING_MESSAGES["5j3k"] = "Thank you for participating, the interview concludes here."
@@ -111,6 +139,16 @@ LOGINS = False
 TRANSCRIPTS_DIRECTORY = "../data/transcripts/"
 TIMES_DIRECTORY = "../data/times/"
 BACKUPS_DIRECTORY = "../data/backups/"
+PROFILES_DIRECTORY = "../data/profiles/"
+
+
+# Profile every script rerun; profiles are written to PROFILES_DIRECTORY. Print a report
+# across all profiled runs with 'python utils.py' from the 'code' folder
+PROFILING = False
+
+# Allow switching on profiling per session with the query parameter 'profile=1'
+# (keep disabled in production, as any respondent could switch it on)
+PROFILING_QUERY_PARAM = False
 
 
 # Avatars displayed in the chat interface
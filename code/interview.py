@@ -5,6 +5,14 @@ from utils import (
     check_if_interview_completed,
     save_interview_data,
     send_transcript_email,
+    store_message,
+    stream_summary,
+    update_running_summary,
+    finish_running_summary,
+    stop_running_summary,
+    start_profiling,
+    profile_phase,
+    stop_profiling,
 )
 import os
 import config
@@ -27,6 +35,16 @@ else:
 # Set page title and icon
 st.set_page_config(page_title="Interview", page_icon=config.AVATAR_INTERVIEWER)
 
+# Check if session ID exists in session state, if not, create one
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+
+# Profile this script run if enabled in config or (if allowed) with the query parameter 'profile=1'
+profiling_enabled = config.PROFILING or (
+    config.PROFILING_QUERY_PARAM and st.query_params.get("profile") == "1"
+)
+start_profiling(profiling_enabled, config.PROFILES_DIRECTORY)
+
 # Function to validate query parameters
 def validate_query_params(params, required_keys):
     # TODO: if doesn't exist, add on a default item. 
@@ -50,16 +68,13 @@ is_valid, missing_params = validate_query_params(query_params, required_params)
 # Display error and stop if parameters are missing
 if not is_valid:
     st.error(f"Missing required parameter(s): {', '.join(missing_params)}")
+    stop_profiling(config.PROFILES_DIRECTORY)
     st.stop()
 
 # Extract respondent's name
 respondent_name = html.unescape(query_params["name"])
 recipient_email = html.unescape(query_params["recipient_email"])
 
-# Check if session ID exists in session state, if not, create one
-if "session_id" not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())
-
 # Display parameters in sidebar
 st.sidebar.title("Interview Details")
 for param in required_params:
@@ -74,6 +89,7 @@ if config.LOGINS:
     # Check password (displays login screen)
     pwd_correct, username = check_password()
     if not pwd_correct:
+        stop_profiling(config.PROFILES_DIRECTORY)
         st.stop()
     else:
         st.session_state.username = username
@@ -81,12 +97,13 @@ else:
     st.session_state.username = "testaccount"
 
 # Create directories if they do not already exist
-if not os.path.exists(config.TRANSCRIPTS_DIRECTORY):
-    os.makedirs(config.TRANSCRIPTS_DIRECTORY)
-if not os.path.exists(config.TIMES_DIRECTORY):
-    os.makedirs(config.TIMES_DIRECTORY)
-if not os.path.exists(config.BACKUPS_DIRECTORY):
-    os.makedirs(config.BACKUPS_DIRECTORY)
+with profile_phase("makedirs"):
+    if not os.path.exists(config.TRANSCRIPTS_DIRECTORY):
+        os.makedirs(config.TRANSCRIPTS_DIRECTORY)
+    if not os.path.exists(config.TIMES_DIRECTORY):
+        os.makedirs(config.TIMES_DIRECTORY)
+    if not os.path.exists(config.BACKUPS_DIRECTORY):
+        os.makedirs(config.BACKUPS_DIRECTORY)
 
 # Initialise session state
 if "interview_active" not in st.session_state:
@@ -96,6 +113,10 @@ if "interview_active" not in st.session_state:
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Initialise list of displayed messages in session state (see store_message)
+if "chat_history" not in st.session_state:
+    st.session_state.chat_history = []
+
 # Store start time in session state
 if "start_time" not in st.session_state:
     st.session_state.start_time = time.time()
@@ -104,9 +125,10 @@ if "start_time" not in st.session_state:
     )
 
 # Check if interview previously completed
-interview_previously_completed = check_if_interview_completed(
-    config.TIMES_DIRECTORY, st.session_state.username
-)
+with profile_phase("check_if_interview_completed"):
+    interview_previously_completed = check_if_interview_completed(
+        config.TIMES_DIRECTORY, st.session_state.username
+    )
 
 # If app started but interview was previously completed
 if interview_previously_completed and not st.session_state.messages:
@@ -130,19 +152,22 @@ with col2:
     if st.session_state.interview_active and st.button("Quit", help="End the interview."):
         st.session_state.interview_active = False
         quit_message = "You have cancelled the interview."
-        st.session_state.messages.append({"role": "assistant", "content": quit_message})
+        store_message("assistant", quit_message)
+        stop_running_summary()
 
         # Save and upload interview data
-        transcript_link = save_interview_data(
-            username=st.session_state.username,
-            transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
-            times_directory=config.TIMES_DIRECTORY,
-            folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
-            student_number=query_params["student_number"],
-            company_name=query_params["company"])
+        with profile_phase("save_interview_data"):
+            transcript_link = save_interview_data(
+                username=st.session_state.username,
+                transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
+                times_directory=config.TIMES_DIRECTORY,
+                folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
+                student_number=query_params["student_number"],
+                company_name=query_params["company"])
         
         # Send email transscript
-        send_transcript_email(query_params["student_number"], query_params["recipient_email"], transcript_link)
+        with profile_phase("send_transcript_email"):
+            send_transcript_email(query_params["student_number"], query_params["recipient_email"], transcript_link)
         
 # After the interview ends
 if not st.session_state.interview_active:
@@ -151,16 +176,18 @@ if not st.session_state.interview_active:
     
     # Ensure transcript is saved before showing the link (When the interview ended natuarlly)
     if "transcript_link" not in st.session_state or not st.session_state.transcript_link:
-        st.session_state.transcript_link = save_interview_data(
-            username=st.session_state.username,
-            transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
-            times_directory=config.TIMES_DIRECTORY,
-            folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
-            student_number=query_params["student_number"],
-            company_name=query_params["company"]
-        )
+        with profile_phase("save_interview_data"):
+            st.session_state.transcript_link = save_interview_data(
+                username=st.session_state.username,
+                transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
+                times_directory=config.TIMES_DIRECTORY,
+                folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
+                student_number=query_params["student_number"],
+                company_name=query_params["company"]
+            )
         # Send email transscript
-        send_transcript_email(query_params["student_number"], query_params["recipient_email"], st.session_state.transcript_link)
+        with profile_phase("send_transcript_email"):
+            send_transcript_email(query_params["student_number"], query_params["recipient_email"], st.session_state.transcript_link)
     
     # Center the button on the page
     st.markdown(f"""
@@ -178,25 +205,28 @@ if not st.session_state.interview_active:
     )        
 
 
-# Upon rerun, display the previous conversation (except system prompt or first message)
-for message in st.session_state.messages[1:]:
+# Container of the conversation, into which the chat fragment below writes new turns
+chat_container = st.container()
 
-    if message["role"] == "assistant":
-        avatar = config.AVATAR_INTERVIEWER
-    else:
-        avatar = config.AVATAR_RESPONDENT
-    # Only display messages without codes
-    if not any(code in message["content"] for code in config.CLOSING_MESSAGES.keys()):
+# Upon rerun, display the previous conversation (except system prompt or first message)
+# Messages with codes are already filtered out when they are stored
+with profile_phase("render_history"), chat_container:
+    for message in st.session_state.chat_history:
+        if message["role"] == "assistant":
+            avatar = config.AVATAR_INTERVIEWER
+        else:
+            avatar = config.AVATAR_RESPONDENT
         with st.chat_message(message["role"], avatar=avatar):
             st.markdown(message["content"])
 
 # Load API client
-if api == "openai":
-    client = OpenAI(api_key=st.secrets["API_KEY"])
-    api_kwargs = {"stream": True}
-elif api == "anthropic":
-    client = anthropic.Anthropic(api_key=st.secrets["API_KEY"])
-    api_kwargs = {"system": config.SYSTEM_PROMPT}
+with profile_phase("client_construction"):
+    if api == "openai":
+        client = OpenAI(api_key=st.secrets["API_KEY"])
+        api_kwargs = {"stream": True}
+    elif api == "anthropic":
+        client = anthropic.Anthropic(api_key=st.secrets["API_KEY"])
+        api_kwargs = {"system": config.SYSTEM_PROMPT}
 
 # API kwargs
 api_kwargs["messages"] = st.session_state.messages
@@ -205,23 +235,26 @@ api_kwargs["max_tokens"] = config.MAX_OUTPUT_TOKENS
 if config.TEMPERATURE is not None:
     api_kwargs["temperature"] = config.TEMPERATURE
 
+# API kwargs of the background summariser (without streaming or interview prompt)
+summary_kwargs = {"model": config.MODEL, "max_tokens": config.SUMMARY_MAX_OUTPUT_TOKENS}
+if config.TEMPERATURE is not None:
+    summary_kwargs["temperature"] = config.TEMPERATURE
+
 # In case the interview history is still empty, pass system prompt to model, and
 # generate and display its first message
 if not st.session_state.messages:
     
     if api == "openai":
 
-        st.session_state.messages.append(
-            {"role": "system", "content": config.INTERVIEW_OUTLINE}
-        )
-        with st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER):
+        store_message("system", config.INTERVIEW_OUTLINE, display=False)
+        with chat_container, st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER), profile_phase("stream"):
             stream = client.chat.completions.create(**api_kwargs)
             message_interviewer = st.write_stream(stream)
 
     elif api == "anthropic":
 
-        st.session_state.messages.append({"role": "user", "content": "Hi"})
-        with st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER):
+        store_message("user", "Hi", display=False)
+        with chat_container, st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER), profile_phase("stream"):
             message_placeholder = st.empty()
             message_interviewer = ""
             with client.messages.stream(**api_kwargs) as stream:
@@ -231,36 +264,41 @@ if not st.session_state.messages:
                     message_placeholder.markdown(message_interviewer + "▌")
             message_placeholder.markdown(message_interviewer)
 
-    st.session_state.messages.append(
-        {"role": "assistant", "content": message_interviewer}
-    )
+    store_message("assistant", message_interviewer)
     
     # Commented out as it does not overwrite old file and create duplicates
 
     # Store first backup files to record who started the interview
-    save_interview_data(
-            username=st.session_state.username,
-            transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
-            times_directory=config.TIMES_DIRECTORY,
-            folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
-            student_number=query_params["student_number"],
-            company_name=query_params["company"] )
-
-# Main chat if interview is active
-if st.session_state.interview_active:
+    with profile_phase("save_interview_data"):
+        save_interview_data(
+                username=st.session_state.username,
+                transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
+                times_directory=config.TIMES_DIRECTORY,
+                folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
+                student_number=query_params["student_number"],
+                company_name=query_params["company"] )
+
+# Main chat as a fragment: submitting a message only reruns this function, which adds
+# the new turns to the chat container, instead of rerunning the whole script and
+# displaying the full conversation again
+@st.fragment
+def chat():
+
+    # Fragment reruns do not run the rest of the script, so they are profiled separately
+    fragment_rerun = "profile_run" not in st.session_state
+    if fragment_rerun:
+        start_profiling(profiling_enabled, config.PROFILES_DIRECTORY)
 
     # Chat input and message for respondent
     if message_respondent := st.chat_input("Your message here"):
-        st.session_state.messages.append(
-            {"role": "user", "content": message_respondent}
-        )
+        store_message("user", message_respondent)
 
         # Display respondent message
-        with st.chat_message("user", avatar=config.AVATAR_RESPONDENT):
+        with chat_container, st.chat_message("user", avatar=config.AVATAR_RESPONDENT):
             st.markdown(message_respondent)
 
         # Generate and display interviewer message
-        with st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER):
+        with chat_container, st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER):
 
             # Create placeholder for message in chat interface
             message_placeholder = st.empty()
@@ -271,27 +309,28 @@ if st.session_state.interview_active:
             if api == "openai":
 
                 # Stream responses
-                stream = client.chat.completions.create(**api_kwargs)
+                with profile_phase("stream"):
+                    stream = client.chat.completions.create(**api_kwargs)
 
-                for message in stream:
-                    text_delta = message.choices[0].delta.content
-                    if text_delta != None:
-                        message_interviewer += text_delta
-                    # Start displaying message only after 5 characters to first check for codes
-                    if len(message_interviewer) > 5:
-                        message_placeholder.markdown(message_interviewer + "▌")
-                    if any(
-                        code in message_interviewer
-                        for code in config.CLOSING_MESSAGES.keys()
-                    ):
-                        # Stop displaying the progress of the message in case of a code
-                        message_placeholder.empty()
-                        break
+                    for message in stream:
+                        text_delta = message.choices[0].delta.content
+                        if text_delta != None:
+                            message_interviewer += text_delta
+                        # Start displaying message only after 5 characters to first check for codes
+                        if len(message_interviewer) > 5:
+                            message_placeholder.markdown(message_interviewer + "▌")
+                        if any(
+                            code in message_interviewer
+                            for code in [*config.CLOSING_MESSAGES.keys(), config.SUMMARY_CODE]
+                        ):
+                            # Stop displaying the progress of the message in case of a code
+                            message_placeholder.empty()
+                            break
 
             elif api == "anthropic":
 
                 # Stream responses
-                with client.messages.stream(**api_kwargs) as stream:
+                with profile_phase("stream"), client.messages.stream(**api_kwargs) as stream:
                     for text_delta in stream.text_stream:
                         if text_delta != None:
                             message_interviewer += text_delta
@@ -300,22 +339,57 @@ if st.session_state.interview_active:
                             message_placeholder.markdown(message_interviewer + "▌")
                         if any(
                             code in message_interviewer
-                            for code in config.CLOSING_MESSAGES.keys()
+                            for code in [*config.CLOSING_MESSAGES.keys(), config.SUMMARY_CODE]
                         ):
                             # Stop displaying the progress of the message in case of a code
                             message_placeholder.empty()
                             break
 
+            # If the summary code is sent again, repeat the summary that was already shown
+            if config.SUMMARY_CODE in message_interviewer and "summary_message" in st.session_state:
+                message_interviewer = st.session_state.summary_message
+
+            # If the summary code is in the message, replace it with the summary that was
+            # precomputed in the background, followed by the concluding question
+            elif config.SUMMARY_CODE in message_interviewer:
+                with profile_phase("finish_running_summary"):
+                    summary, remaining_turns = finish_running_summary()
+                message_placeholder.markdown(summary + "▌")
+
+                # Stream the summary of the last turns, which were not yet summarised in
+                # the background, after the precomputed pieces
+                if remaining_turns:
+                    precomputed_summary = summary
+                    if summary:
+                        summary += "\n\n"
+                    try:
+                        with profile_phase("stream_summary"):
+                            for text_delta in stream_summary(
+                                client, api, summary_kwargs, remaining_turns
+                            ):
+                                summary += text_delta
+                                message_placeholder.markdown(summary + "▌")
+
+                    # Keep only the precomputed pieces if streaming fails
+                    except Exception:
+                        summary = precomputed_summary
+
+                if not summary.strip():
+                    summary = config.SUMMARY_UNAVAILABLE
+                message_interviewer = f"{summary.strip()}\n\n{config.SUMMARY_QUESTION}"
+                st.session_state.summary_message = message_interviewer
+
             # If no code is in the message, display and store the message
             if not any(
                 code in message_interviewer for code in config.CLOSING_MESSAGES.keys()
             ):
 
                 message_placeholder.markdown(message_interviewer)
-                st.session_state.messages.append(
-                    {"role": "assistant", "content": message_interviewer}
-                )
+                store_message("assistant", message_interviewer)
 
+                # Summarise the new turns in the background
+                with profile_phase("update_running_summary"):
+                    update_running_summary(client, api, summary_kwargs)
                 
                 
                 # Commented out as it does not overwrite old file and create duplicates
@@ -324,13 +398,14 @@ if st.session_state.interview_active:
                 # # stopping in case of a write error
                 try:
 
-                    transcript_link = save_interview_data(
-                    username=st.session_state.username,
-                    transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
-                    times_directory=config.TIMES_DIRECTORY,
-                    folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
-                    student_number=query_params["student_number"],
-                    company_name=query_params["company"] )
+                    with profile_phase("save_interview_data"):
+                        transcript_link = save_interview_data(
+                        username=st.session_state.username,
+                        transcripts_directory=config.TRANSCRIPTS_DIRECTORY,
+                        times_directory=config.TIMES_DIRECTORY,
+                        folder_id="123xBZ2YDy8BZrbErQb0U9TpGY-j3NdK7",
+                        student_number=query_params["student_number"],
+                        company_name=query_params["company"] )
 
                 except:
 
@@ -341,21 +416,19 @@ if st.session_state.interview_active:
             # Loop over all codes
             for code in config.CLOSING_MESSAGES.keys():
                 if code in message_interviewer:
-                    # Store message in list of messages
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": message_interviewer}
-                    )
+                    # Store message in list of messages (not displayed as it contains a code)
+                    store_message("assistant", message_interviewer)
 
                     # Set chat to inactive and display closing message
                     st.session_state.interview_active = False
+                    stop_running_summary()
                     closing_message = config.CLOSING_MESSAGES[code]
                     st.markdown(closing_message)
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": closing_message}
-                    )
+                    store_message("assistant", closing_message)
                     
                     # Delay for 5 seconds before rerunning
                     time.sleep(5)
+                    stop_profiling(config.PROFILES_DIRECTORY)
                     st.rerun()
 
 
@@ -377,4 +450,13 @@ if st.session_state.interview_active:
                     #     )
                     # time.sleep(0.1)
                     #
-                    
+
+    if fragment_rerun:
+        stop_profiling(config.PROFILES_DIRECTORY)
+
+# Main chat if interview is active
+if st.session_state.interview_active:
+    chat()
+
+# Write the profile of this script run (if profiling is enabled)
+stop_profiling(config.PROFILES_DIRECTORY)
@@ -6,9 +6,15 @@ from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 import json
+import glob
+import cProfile
+import pstats
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+import config
 
 
 # Password screen for dashboard (note: only very basic authentication!)
@@ -66,6 +72,147 @@ def check_if_interview_completed(directory, username):
         return False
 
 
+def store_message(role, content, display=True):
+    """Append a message to the interview history and, if it is displayed, to the chat history.
+
+    Messages containing a code, and messages with display=False (system prompt or first
+    message), are only passed to the model. The chat history is replayed on full reruns,
+    so the check for codes is done once here instead of for every message on every rerun.
+    """
+
+    message = {"role": role, "content": content}
+    st.session_state.messages.append(message)
+
+    # The chat history refers to the same message, it does not store a copy
+    if display and not any(code in content for code in config.CLOSING_MESSAGES.keys()):
+        st.session_state.chat_history.append(message)
+
+
+def _summary_messages(turns):
+    """Build the request of the summariser for a batch of interview turns."""
+
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in turns)
+    return [{"role": "user", "content": f"Part of the interview transcript:\n{transcript}"}]
+
+
+def summarise_turns(client, api, api_kwargs, turns):
+    """Summarise a batch of interview turns into one piece of the summary."""
+
+    if api == "openai":
+        response = client.chat.completions.create(
+            messages=[{"role": "system", "content": config.SUMMARY_PROMPT}]
+            + _summary_messages(turns),
+            **api_kwargs,
+        )
+        return response.choices[0].message.content
+
+    elif api == "anthropic":
+        response = client.messages.create(
+            system=config.SUMMARY_PROMPT, messages=_summary_messages(turns), **api_kwargs
+        )
+        return response.content[0].text
+
+
+def stream_summary(client, api, api_kwargs, turns):
+    """Summarise a batch of interview turns into one piece of the summary, yielding text deltas."""
+
+    if api == "openai":
+        stream = client.chat.completions.create(
+            messages=[{"role": "system", "content": config.SUMMARY_PROMPT}]
+            + _summary_messages(turns),
+            stream=True,
+            **api_kwargs,
+        )
+        for message in stream:
+            text_delta = message.choices[0].delta.content
+            if text_delta != None:
+                yield text_delta
+
+    elif api == "anthropic":
+        with client.messages.stream(
+            system=config.SUMMARY_PROMPT, messages=_summary_messages(turns), **api_kwargs
+        ) as stream:
+            for text_delta in stream.text_stream:
+                if text_delta != None:
+                    yield text_delta
+
+
+def update_running_summary(client, api, api_kwargs):
+    """Summarise new messages in the background, off the chat path.
+
+    Once config.SUMMARY_FOLD_MESSAGES new messages have accumulated, they are summarised
+    as a separate, short piece of the summary. Pieces are independent of each other, so
+    their size does not grow with the interview and they can be summarised in parallel.
+    """
+
+    if st.session_state.get("summary_finished", False):
+        return
+
+    # Skip the system prompt or first message, and leave a trailing question of the
+    # interviewer for the next piece, so that it is summarised together with its answer
+    summarised_messages = st.session_state.get("summarised_messages", 1)
+    new_turns = st.session_state.messages[summarised_messages:]
+    if new_turns and new_turns[-1]["role"] == "assistant":
+        new_turns = new_turns[:-1]
+    if len(new_turns) < config.SUMMARY_FOLD_MESSAGES:
+        return
+
+    if "summary_executor" not in st.session_state:
+        st.session_state.summary_executor = ThreadPoolExecutor(max_workers=2)
+        st.session_state.summary_pieces = []
+
+    st.session_state.summary_pieces.append(
+        {
+            "turns": new_turns,
+            "future": st.session_state.summary_executor.submit(
+                summarise_turns, client, api, api_kwargs, new_turns
+            ),
+        }
+    )
+    st.session_state.summarised_messages = summarised_messages + len(new_turns)
+
+
+def finish_running_summary():
+    """Collect the pieces of the summary that were precomputed in the background.
+
+    Returns the summary joined from the pieces and the turns that still have to be
+    summarised: those after the last piece and, if a piece failed, also those from the
+    failed piece onwards (so that the summary stays in the order of the interview).
+    """
+
+    summary_pieces = st.session_state.pop("summary_pieces", [])
+    remaining_turns = st.session_state.messages[
+        st.session_state.get("summarised_messages", 1):
+    ]
+
+    pieces = []
+    for i, piece in enumerate(summary_pieces):
+        try:
+            text = piece["future"].result()
+        except Exception:
+            text = None
+
+        # A failed or empty piece is summarised again with the remaining turns
+        if not text:
+            failed_turns = [turn for failed in summary_pieces[i:] for turn in failed["turns"]]
+            remaining_turns = failed_turns + remaining_turns
+            break
+        pieces.append(text)
+
+    stop_running_summary()
+
+    return "\n\n".join(pieces), remaining_turns
+
+
+def stop_running_summary():
+    """Stop the background summariser, cancelling summaries that have not started yet."""
+
+    st.session_state.summary_finished = True
+    summary_executor = st.session_state.pop("summary_executor", None)
+    if summary_executor is not None:
+        summary_executor.shutdown(wait=False, cancel_futures=True)
+
+
 def save_interview_data(username, transcripts_directory, times_directory, folder_id, student_number, company_name):
     """Save interview data locally and upload to Google Drive with correct file naming."""
 
@@ -204,4 +351,148 @@ def send_transcript_email(student_number, recipient_email, transcript_link):
         server.quit()
         print(f"Email sent to {recipients}")
     except Exception as e:
-        print(f"Error sending email: {e}")
\ No newline at end of file
+        print(f"Error sending email: {e}")
+
+
+def start_profiling(enabled, directory):
+    """Start profiling the current script run if profiling is enabled.
+
+    A previous run that was interrupted by Streamlit (e.g. by a click while a response was
+    streaming) never reached stop_profiling, so its profile is written here instead.
+    """
+
+    if "profile_run" in st.session_state:
+        _write_profile(st.session_state.pop("profile_run"), directory, interrupted=True)
+
+    if not enabled:
+        return
+
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    st.session_state.profile_run = {
+        "profiler": profiler,
+        "started": started,
+        "last_phase_ended": started,
+        "phases": {},
+    }
+    profiler.enable()
+
+
+@contextmanager
+def profile_phase(name):
+    """Record the wall time of a named phase of the current script run."""
+
+    profile_run = st.session_state.get("profile_run")
+    if profile_run is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile_run["last_phase_ended"] = time.perf_counter()
+        phases = profile_run["phases"]
+        phases[name] = phases.get(name, 0.0) + profile_run["last_phase_ended"] - started
+
+
+def stop_profiling(directory):
+    """Stop profiling the current script run and write its profile to the directory.
+
+    Must be called before st.stop() and st.rerun(), which end the script run early.
+    """
+
+    profile_run = st.session_state.pop("profile_run", None)
+    if profile_run is not None:
+        _write_profile(profile_run, directory, interrupted=False)
+
+
+def _write_profile(profile_run, directory, interrupted):
+    """Write the cProfile stats and phase timings of a script run to the directory."""
+
+    profile_run["profiler"].disable()
+
+    # The end of an interrupted run is unknown, so its total ends with its last phase
+    if interrupted:
+        total = profile_run["last_phase_ended"] - profile_run["started"]
+    else:
+        total = time.perf_counter() - profile_run["started"]
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # Number the runs of each session so that profiles are not overwritten
+    st.session_state.profile_run_count = st.session_state.get("profile_run_count", 0) + 1
+    session_id = st.session_state.session_id
+    file_stem = os.path.join(
+        directory, f"{session_id}_{st.session_state.profile_run_count:04d}"
+    )
+
+    profile_run["profiler"].dump_stats(f"{file_stem}.prof")
+    with open(f"{file_stem}.json", "w") as f:
+        json.dump(
+            {
+                "session_id": session_id,
+                "run": st.session_state.profile_run_count,
+                "interrupted": interrupted,
+                "total": total,
+                "phases": profile_run["phases"],
+            },
+            f,
+            indent=2,
+        )
+
+
+def print_profile_report(directory, limit=25):
+    """Print an aggregate hot-path report over all profiled runs in the directory.
+
+    Usage (from the 'code' folder): python utils.py
+    """
+
+    profile_files = sorted(glob.glob(os.path.join(directory, "*.prof")))
+    if not profile_files:
+        print(f"No profiles found in {directory}")
+        return
+
+    # Average wall time per phase across runs
+    totals = {}
+    counts = {}
+    run_total = 0.0
+    completed_runs = 0
+    phase_files = sorted(glob.glob(os.path.join(directory, "*.json")))
+    for phase_file in phase_files:
+        with open(phase_file, "r") as f:
+            run = json.load(f)
+        # Only completed runs count towards the mean run time
+        if not run.get("interrupted", False):
+            run_total += run["total"]
+            completed_runs += 1
+        for name, seconds in run["phases"].items():
+            totals[name] = totals.get(name, 0.0) + seconds
+            counts[name] = counts.get(name, 0) + 1
+
+    sessions = {os.path.basename(f).rsplit("_", 1)[0] for f in profile_files}
+    print(
+        f"Profiled runs: {len(profile_files)} across {len(sessions)} session(s), "
+        f"{len(phase_files) - completed_runs} interrupted"
+    )
+    if phase_files:
+        if completed_runs:
+            print(f"Mean run time (completed runs): {run_total / completed_runs * 1000:.1f} ms")
+        print()
+        print(f"{'Phase':<30}{'Runs':>6}{'Mean (ms)':>12}{'Total (s)':>12}")
+        for name in sorted(totals, key=totals.get, reverse=True):
+            print(
+                f"{name:<30}{counts[name]:>6}"
+                f"{totals[name] / counts[name] * 1000:>12.1f}{totals[name]:>12.2f}"
+            )
+        print()
+
+    # Hot functions across all runs
+    stats = pstats.Stats(*profile_files)
+    stats.sort_stats("cumulative").print_stats(limit)
+
+
+# Print the report of profiled runs (see config.PROFILING)
+if __name__ == "__main__":
+    print_profile_report(config.PROFILES_DIRECTORY)